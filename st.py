@@ -1,250 +1,151 @@
+import hashlib
 import os
-import re
-import tempfile
 
-from typing import List, Dict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-import pandas as pd
-import PyPDF2
-import pytesseract
-from pdf2image import convert_from_path
 import streamlit as st
 
-# ─── Configuration ────────────────────────────────────────────────────────────
-script_dir = (
-    os.path.dirname(os.path.abspath(__file__)) if "__file__" in locals() else os.getcwd()
+from toc_core import (
+    FALLBACK_MAX_PAGES,
+    FALLBACK_MIN_ENTRIES,
+    FALLBACK_MISS_STREAK,
+    LARGE_PDF_BYTES,
+    LARGE_PDF_MAX_PAGES,
+    OCR_DPI,
+    OCR_WORKERS,
+    TocAccumulator,
+    find_toc_page_indices,
+    iter_text_from_pages,
+    iter_text_from_pdf,
+    opened_pdf,
+    parse_toc,
+    remove_upload,
+    save_upload,
 )
-POPPLER_PATH = os.path.join(script_dir, "poppler", "bin")
-TESSERACT_CMD = (
-    "tesseract.exe"
-    if os.name == "nt"
-    else "/usr/bin/tesseract"
-)
-pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
 
+if TYPE_CHECKING:
+    import pandas as pd
 
-def get_poppler_path() -> str:
-    return POPPLER_PATH
+# Results kept per cached function, shared by all sessions; the least recently
+# used are evicted first, so memory doesn't grow with every PDF ever uploaded
+CACHE_MAX_ENTRIES = 64
 
 
-def truncate_pdf(input_path: str, output_path: str, max_pages: int = 70) -> None:
-    """
-    Create a truncated version of a PDF containing only the first `max_pages`.
-    """
-    reader = PyPDF2.PdfReader(input_path)
-    writer = PyPDF2.PdfWriter()
-    
-    num_pages = len(reader.pages)
-    pages_to_keep = min(max_pages, num_pages)
-    
-    for i in range(pages_to_keep):
-        writer.add_page(reader.pages[i])
-    
-    with open(output_path, "wb") as f:
-        writer.write(f)
-
-
-def strip_hindi_chars(text: str) -> str:
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def scan_toc_pages(pdf_hash: str, _pdf_path: str) -> Tuple[List[int], int, Dict[str, Any]]:
     """
-    Remove any Devanagari (Hindi) characters from `text`.
-    Devanagari Unicode block: U+0900–U+097F
+    Find TOC pages among the first 20 pages. Returns the TOC page indices, the
+    page count and the PdfContext memo (every page's text read so far), so the
+    extraction step can start from it. Cached on `pdf_hash` alone: it doesn't
+    depend on any extraction option. Errors propagate, so a failed scan isn't
+    cached and is retried on the next extraction.
     """
-    return re.sub(r"[\u0900-\u097F]+", "", text)
-
-
-def extract_page_text(pdf_path: str, page_num: int, lang: str = "eng") -> str:
+    with opened_pdf(_pdf_path, cache_key=pdf_hash) as ctx:
+        toc_indices = find_toc_page_indices(ctx, max_search_pages=20)
+        return toc_indices, ctx.num_pages, ctx.memo()
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def parse_toc_pages(
+    pdf_hash: str,
+    _pdf_path: str,
+    page_indices: Tuple[int, ...],
+    lang: str = "eng",
+    dpi: int = OCR_DPI,
+    whole_pdf: bool = False,
+    _memo: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, str]]:
     """
-    Extract text from a single page (0-based). If the PDF‐embedded text is empty,
-    attempt OCR—only if Poppler (pdftoppm) exists. Do NOT strip Hindi here; that
-    will be done later per-line.
+    Extract (or OCR, at `dpi`) `page_indices` and parse them line by line into
+    chapter→page entries. An empty `page_indices` means the start of the PDF: up
+    to FALLBACK_MAX_PAGES pages (every page with `whole_pdf`), read only until the
+    TOC looks complete (see FALLBACK_MIN_ENTRIES). Pages already read by
+    scan_toc_pages come from `_memo` instead of being read again.
     """
-    page_text = ""
-    poppler_path = get_poppler_path()
-    poppler_exists = os.path.exists(os.path.join(poppler_path, "pdftoppm"))
-
-    with open(pdf_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        if page_num < len(reader.pages):
-            page = reader.pages[page_num]
-            page_text = page.extract_text() or ""
-
-            # If PDF text is blank/whitespace, attempt OCR
-            if not page_text.strip() and poppler_exists:
-                try:
-                    images = convert_from_path(
-                        pdf_path,
-                        first_page=page_num + 1,
-                        last_page=page_num + 1,
-                        poppler_path=poppler_path,
-                        dpi=400,
-                        grayscale=True,
-                    )
-                    if images:
-                        img = images[0]
-                        page_text = pytesseract.image_to_string(
-                            img, lang=lang, config="--psm 6"
-                        )
-                except Exception:
-                    page_text = ""
-
-    return page_text + "\n"
-
-
-def extract_text_from_pages(
-    pdf_path: str, page_indices: List[int], lang: str = "eng"
-) -> str:
+    with opened_pdf(_pdf_path, cache_key=pdf_hash, **(_memo or {})) as ctx:
+        if page_indices:
+            page_texts = iter_text_from_pages(ctx, list(page_indices), lang=lang, dpi=dpi)
+            return parse_toc(line for page_text in page_texts for line in page_text.split("\n"))
+
+        # Parse pages as they arrive and stop once enough entries are in and the
+        # last few pages added nothing, so the body text after the TOC isn't OCR'd
+        acc = TocAccumulator()
+        miss_streak = 0
+        window = max(OCR_WORKERS, FALLBACK_MISS_STREAK)
+        page_texts = iter_text_from_pdf(
+            ctx,
+            lang=lang,
+            window=window,
+            dpi=dpi,
+            max_pages=None if whole_pdf else FALLBACK_MAX_PAGES,
+        )
+        for page_text in page_texts:
+            miss_streak = 0 if acc.feed(page_text) else miss_streak + 1
+            if len(acc.entries) >= FALLBACK_MIN_ENTRIES and miss_streak >= FALLBACK_MISS_STREAK:
+                break
+        return acc.entries
+
+
+def run_toc_pipeline(
+    pdf_hash: str,
+    pdf_path: str,
+    extra_pages: int,
+    lang: str = "eng",
+    dpi: int = OCR_DPI,
+    whole_pdf: bool = False,
+) -> List[Dict[str, str]]:
     """
-    Extract (or OCR) text from the specified pages. Hindi characters
-    remain in the returned string; parsing will strip them line by line.
+    Run the whole extraction for an uploaded PDF (saved at `pdf_path` by
+    save_upload) and return the parsed TOC entries:
+      1. Find TOC pages among the first 20 pages (scan_toc_pages).
+      2. Add `extra_pages` after each; if none are found, fall back to the first
+         FALLBACK_MAX_PAGES pages (the entire PDF with `whole_pdf`).
+      3. Extract (or OCR, at `dpi`) those pages and parse them (parse_toc_pages).
+    Both stages are cached on `pdf_hash` (the SHA-1 of the upload, computed by
+    save_upload while copying it): the scan runs once per PDF, changing
+    `extra_pages` only extracts the pages that weren't read yet, and changing
+    `dpi` only re-OCRs the scanned pages (embedded text is reused). Repeating an
+    extraction is instant, and OCR results are also kept on disk (OCR_CACHE_DIR)
+    for later runs of the app.
     """
-    accumulated = ""
-    for idx in page_indices:
-        accumulated += extract_page_text(pdf_path, idx, lang=lang)
-    return accumulated
+    try:
+        toc_indices, num_pages, memo = scan_toc_pages(pdf_hash, pdf_path)
+    except Exception as e:
+        # Fall back as if no TOC page was found; the failure isn't cached
+        st.error(f"Error finding TOC pages: {e}")
+        toc_indices, num_pages, memo = [], 0, None
+
+    # Expand each found index by extra_pages (making sure not to exceed num_pages)
+    expanded_indices = set()
+    for i in toc_indices:
+        for offset in range(0, extra_pages + 1):
+            candidate = i + offset
+            if candidate < num_pages:
+                expanded_indices.add(candidate)
+    final_indices = tuple(sorted(expanded_indices))
+
+    return parse_toc_pages(
+        pdf_hash, pdf_path, final_indices, lang=lang, dpi=dpi, whole_pdf=whole_pdf, _memo=memo
+    )
 
 
-def extract_text_from_pdf(pdf_path: str, lang: str = "eng") -> str:
+def df_fingerprint(df: "pd.DataFrame") -> str:
     """
-    Extract (or OCR) text from all pages, concatenated. Hindi remains until parsing.
+    Hash of a DataFrame's columns and values (pandas' vectorised row hashes),
+    far cheaper to compute than serialising the frame.
     """
-    full_text = ""
-    poppler_path = get_poppler_path()
-    poppler_exists = os.path.exists(os.path.join(poppler_path, "pdftoppm"))
-
-    with open(pdf_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        num_pages = len(reader.pages)
-
-        for page_num in range(num_pages):
-            page = reader.pages[page_num]
-            page_text = page.extract_text() or ""
-
-            if not page_text.strip() and poppler_exists:
-                try:
-                    images = convert_from_path(
-                        pdf_path,
-                        first_page=page_num + 1,
-                        last_page=page_num + 1,
-                        poppler_path=poppler_path,
-                        dpi=400,
-                        grayscale=True,
-                    )
-                    if images:
-                        img = images[0]
-                        page_text = pytesseract.image_to_string(
-                            img, lang=lang, config="--psm 6"
-                        )
-                except Exception:
-                    page_text = ""
+    import pandas as pd
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.sha1(repr(list(df.columns)).encode("utf-8") + row_hashes.tobytes()).hexdigest()
 
-            full_text += page_text + "\n"
 
-    return full_text
-
-
-def parse_toc(text: str) -> List[Dict[str, str]]:
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def df_to_csv_bytes(df_hash: str, _df: "pd.DataFrame") -> bytes:
     """
-    Given a block of text (which may still contain Hindi), parse TOC entries by:
-    - Combining lines that are part of the same entry (multi-line titles)
-    - Stripping Hindi characters from combined entries
-    - Skipping entries that contain header terms (like 'contents', 'page', etc.)
-    - Using regex to capture "Chapter Title ... 12" or "Chapter Title - 12"
+    `_df` as UTF-8 CSV bytes. Cached on `df_hash` (its df_fingerprint), so reruns
+    that leave the table unchanged don't serialise it again.
     """
-    entries: List[Dict[str, str]] = []
-    skip_terms = ["table of contents", "contents", "page", "toc"]
-    current_entry_lines = []  # Collect lines for the current TOC entry
-
-    for raw_line in text.split('\n'):
-        line = raw_line.strip()
-        if not line:
-            continue
-        
-        cleaned = strip_hindi_chars(line)
-        
-        # Check if this line ends with a sequence of digits (page number)
-        if re.search(r'\d+\s*$', cleaned):
-            full_text = ""
-            if current_entry_lines:
-                # Combine buffered lines with current line
-                full_text = " ".join(current_entry_lines) + " " + cleaned
-                current_entry_lines = []  # Reset buffer
-            else:
-                full_text = cleaned
-                
-            # Skip entries that contain header terms
-            lower_text = full_text.lower()
-            if any(term in lower_text for term in skip_terms):
-                continue
-                
-            # Attempt to split into chapter and page number
-            m = re.match(r'^(.*?)[\s\.\-]+\s*(\d+)\s*$', full_text)
-            if not m:
-                # Fallback: match any trailing digits
-                m = re.match(r'^(.*?)(\d+)\s*$', full_text)
-                
-            if m:
-                chapter = m.group(1).strip()
-                page_no = m.group(2).strip()
-                entries.append({"chapter": chapter, "page": page_no})
-        else:
-            # Line doesn't end with page number → buffer it
-            current_entry_lines.append(cleaned)
-            
-    return entries
-
-
-def find_toc_page_indices(pdf_path: str, max_search_pages: int = 20) -> List[int]:
-    """
-    Look at the first `max_search_pages` pages of the PDF (or fewer if the PDF is shorter).
-    For each page:
-      1. Extract text (via PyPDF2). If blank and poppler exists, do OCR.
-      2. Check the raw text (with both English & Hindi still present) for the substring "contents" (case‐insensitive).
-      3. If "contents" is found, run parse_toc(...) on that raw text. If parse_toc returns ≥ 2 entries, mark this page as TOC.
-    Return a list of all page indices that look like TOC pages.
-    """
-    indices: List[int] = []
-    poppler_path = get_poppler_path()
-    poppler_exists = os.path.exists(os.path.join(poppler_path, "pdftoppm"))
-
-    try:
-        reader = PyPDF2.PdfReader(pdf_path)
-        num_pages = len(reader.pages)
-        search_limit = min(num_pages, max_search_pages)
-
-        for i in range(search_limit):
-            page = reader.pages[i]
-            raw_text = page.extract_text() or ""
-
-            # If PDF text is blank and poppler exists, do a quick page‐OCR
-            if not raw_text.strip() and poppler_exists:
-                try:
-                    images = convert_from_path(
-                        pdf_path,
-                        first_page=i + 1,
-                        last_page=i + 1,
-                        poppler_path=poppler_path,
-                        dpi=300,
-                        grayscale=True,
-                    )
-                    if images:
-                        raw_text = pytesseract.image_to_string(images[0], lang="eng")
-                except Exception:
-                    raw_text = ""
-
-            lower_all = raw_text.lower()
-            # We look for the English word "contents" (case‐insensitive) in the raw text
-            if "contents" in lower_all:
-                # Now see if parsing that page yields ≥ 2 valid TOC entries
-                possible_entries = parse_toc(raw_text)
-                if len(possible_entries) >= 2:
-                    indices.append(i)
-                    # Don’t break—TOC can span multiple consecutive pages
-
-        return indices
-
-    except Exception as e:
-        st.error(f"Error finding TOC pages: {e}")
-        return []
+    return _df.to_csv(index=False).encode("utf-8")
 
 
 # ─── Streamlit UI ──────────────────────────────────────────────────────────────
@@ -261,8 +162,14 @@ if "df" not in st.session_state:
     st.session_state.df = None
 if "pdf_name" not in st.session_state:
     st.session_state.pdf_name = ""
-if "raw_pdf_bytes" not in st.session_state:
-    st.session_state.raw_pdf_bytes = None
+if "pdf_path" not in st.session_state:
+    st.session_state.pdf_path = ""
+if "pdf_size" not in st.session_state:
+    st.session_state.pdf_size = 0
+if "pdf_hash" not in st.session_state:
+    st.session_state.pdf_hash = ""
+if "pdf_file_id" not in st.session_state:
+    st.session_state.pdf_file_id = ""
 
 
 def main():
@@ -286,15 +193,30 @@ def main():
         "Choose a PDF file", type=["pdf"], label_visibility="collapsed"
     )
 
-    if uploaded_file and st.session_state.raw_pdf_bytes is None:
-        pdf_bytes = uploaded_file.read()
-        st.session_state.raw_pdf_bytes = pdf_bytes
-        st.session_state.pdf_name = uploaded_file.name
-        st.session_state.extracted = False
-        st.success("PDF uploaded successfully!")
+    if st.session_state.pdf_path and (
+        uploaded_file is None or uploaded_file.file_id != st.session_state.pdf_file_id
+    ):
+        # The upload was removed or replaced: delete its saved copy
+        remove_upload(st.session_state.pdf_path)
+        st.session_state.pdf_path = ""
+        st.session_state.pdf_hash = ""
+        st.session_state.pdf_file_id = ""
+
+    if uploaded_file and not st.session_state.pdf_path:
+        # Write the upload to disk once; only its path (and hash) stays in session state
+        try:
+            st.session_state.pdf_path, st.session_state.pdf_hash = save_upload(uploaded_file)
+        except Exception as e:
+            st.error(f"Could not read the uploaded PDF: {e}")
+        else:
+            st.session_state.pdf_file_id = uploaded_file.file_id
+            st.session_state.pdf_size = uploaded_file.size
+            st.session_state.pdf_name = uploaded_file.name
+            st.session_state.extracted = False
+            st.success("PDF uploaded successfully!")
 
     # ─── Step 2: Extract TOC ─────────────────────────────────────────────────
-    if st.session_state.raw_pdf_bytes and not st.session_state.extracted:
+    if st.session_state.pdf_path and not st.session_state.extracted:
         st.subheader("2. Extract Table of Contents")
         with st.form("extract_form"):
             # We force English OCR—Hindi characters will be stripped per-line later
@@ -309,53 +231,40 @@ def main():
                 help="If you notice that some TOC entries span into subsequent pages, increase this value.",
             )
 
+            # Applies to every page the TOC is read from that has to be OCR'd; finding
+            # the TOC pages always reads at OCR_DPI
+            ocr_dpi = st.slider(
+                "OCR resolution (DPI)",
+                min_value=150,
+                max_value=600,
+                value=OCR_DPI,
+                step=50,
+                help="Used to OCR scanned TOC pages. Higher values can help with small print but make OCR slower.",
+            )
+
+            whole_pdf = st.checkbox(
+                f"If no TOC page is found, search the whole PDF (not just the first {FALLBACK_MAX_PAGES} pages)",
+                value=False,
+                help="Can take several minutes on long scanned PDFs, since every page may need OCR.",
+            )
+
             if st.form_submit_button("🔍 Extract TOC"):
+                import pandas as pd
                 with st.spinner("Extracting TOC..."):
-                    # Save uploaded PDF to a temp file
-                    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-                        tmp.write(st.session_state.raw_pdf_bytes)
-                        original_tmp_path = tmp.name
-                    
                     # Check if PDF is large (>100 MB)
-                    file_size = os.path.getsize(original_tmp_path)
-                    is_large_pdf = file_size > 100 * 1024 * 1024  # 100 MB
-                    
-                    if is_large_pdf:
-                        st.info(f"Large PDF detected ({file_size/(1024*1024):.2f} MB). Using first 70 pages for TOC extraction.")
-                        # Create a new temp file for the truncated version
-                        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as trunc_tmp:
-                            truncated_path = trunc_tmp.name
-                        truncate_pdf(original_tmp_path, truncated_path, max_pages=70)
-                        extraction_path = truncated_path
-                    else:
-                        extraction_path = original_tmp_path
-                    
-                    try:
-                        # 1) Find potential TOC pages among the first 20 pages
-                        toc_indices = find_toc_page_indices(extraction_path, max_search_pages=20)
-
-                        if toc_indices:
-                            # Expand each found index by extra_pages (making sure not to exceed num_pages)
-                            reader = PyPDF2.PdfReader(extraction_path)
-                            num_pages = len(reader.pages)
+                    file_size = st.session_state.pdf_size
+                    if file_size > LARGE_PDF_BYTES:
+                        st.info(f"Large PDF detected ({file_size/(1024*1024):.2f} MB). Using first {LARGE_PDF_MAX_PAGES} pages for TOC extraction.")
 
-                            expanded_indices = set()
-                            for i in toc_indices:
-                                for offset in range(0, extra_pages + 1):
-                                    candidate = i + offset
-                                    if candidate < num_pages:
-                                        expanded_indices.add(candidate)
-                            final_indices = sorted(expanded_indices)
-
-                            # 2) Extract text from all expanded TOC pages (OCR if needed)
-                            raw_text = extract_text_from_pages(extraction_path, final_indices, lang="eng")
-
-                        else:
-                            # If none detected, fall back to entire PDF
-                            raw_text = extract_text_from_pdf(extraction_path, lang="eng")
-
-                        # 3) Parse the collected text to extract chapter→page entries
-                        toc_entries = parse_toc(raw_text)
+                    try:
+                        toc_entries = run_toc_pipeline(
+                            st.session_state.pdf_hash,
+                            st.session_state.pdf_path,
+                            int(extra_pages),
+                            lang="eng",
+                            dpi=int(ocr_dpi),
+                            whole_pdf=whole_pdf,
+                        )
 
                         if toc_entries:
                             st.session_state.df = pd.DataFrame(toc_entries)
@@ -375,11 +284,6 @@ def main():
                             )
                     except Exception as e:
                         st.error(f"Extraction error: {e}")
-                    finally:
-                        # Clean up temporary files
-                        os.unlink(original_tmp_path)
-                        if is_large_pdf:
-                            os.unlink(extraction_path)  # This is the truncated_path
 
     # ─── Step 3: View TOC ────────────────────────────────────────────────────
     if st.session_state.extracted and st.session_state.df is not None:
@@ -414,21 +318,15 @@ def main():
         with col_btn:
             st.write("")  # For vertical alignment
             if st.button("➕ Insert Empty Row", use_container_width=True):
-                # Create an empty row
-                empty_row = {col: "" for col in edited_df.columns}
-                
+                import numpy as np
+                import pandas as pd
                 # Convert to 0-indexed position
                 pos = insert_position - 1
                 
-                # Split the DataFrame and insert the new row
-                top_part = edited_df.iloc[:pos]
-                bottom_part = edited_df.iloc[pos:]
-                
-                # Combine with the new row
-                edited_df = pd.concat(
-                    [top_part, pd.DataFrame([empty_row]), bottom_part],
-                    ignore_index=True
-                )
+                # Insert an empty row into the underlying values: one copy of
+                # the table instead of splitting and concatenating it
+                values = np.insert(edited_df.to_numpy(dtype=object), pos, "", axis=0)
+                edited_df = pd.DataFrame(values, columns=edited_df.columns)
                 
                 # Update the edited DataFrame
                 st.session_state.df = edited_df
@@ -447,7 +345,7 @@ def main():
     # ─── Step 5/6: Download CSV ──────────────────────────────────────────────
     if st.session_state.extracted and st.session_state.df is not None:
         st.subheader("5. Download Results")
-        csv_data = st.session_state.df.to_csv(index=False).encode("utf-8")
+        csv_data = df_to_csv_bytes(df_fingerprint(st.session_state.df), st.session_state.df)
         csv_name = (
             f"{os.path.splitext(st.session_state.pdf_name)[0]}_TOC.csv"
             if st.session_state.pdf_name